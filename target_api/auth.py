@@ -0,0 +1,56 @@
+"""Shared authenticator for target-api."""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from target_hotglue.auth import ApiAuthenticator
+
+
+class CachedApiAuthenticator(ApiAuthenticator):
+    """Target-wide cache of the api key headers, shared by every sink.
+
+    The headers are built once from the target's config and reused for every
+    request. When they are invalidated (e.g. after a 401) the api key is read
+    again from the target's config files, so a key rotated while the job runs is
+    picked up. Refreshes are
+    single-flight: concurrent callers wait on the same refresh instead of racing.
+    """
+
+    def __init__(self, target, header_name: str = "x-api-key") -> None:
+        super().__init__(target, header_name=header_name)
+        self._api_target = target
+        self._api_key_header = header_name
+        self._lock = threading.Lock()
+        self._cached_headers: Optional[dict] = None
+        self._reload_api_key = False
+
+    @property
+    def auth_headers(self) -> dict:
+        with self._lock:
+            if self._cached_headers is None:
+                self._refresh()
+            # copy read under the lock so a concurrent invalidate can't leave us with None
+            return dict(self._cached_headers)
+
+    def _refresh(self) -> None:
+        headers = dict(super().auth_headers)
+        # the first headers come from the target's config (env config included),
+        # the config files are only re-read once the key has been rejected
+        if self._reload_api_key:
+            headers[self._api_key_header] = self._api_target.read_api_key()
+        else:
+            headers[self._api_key_header] = self._api_target.config.get("api_key")
+        self._cached_headers = headers
+
+    def invalidate(self, auth_headers: Optional[dict] = None) -> None:
+        """Drop the cached headers so the next caller reloads the api key.
+
+        Args:
+            auth_headers: The headers the failed request was sent with. If the cache
+                was already refreshed by another caller it is left untouched.
+        """
+        with self._lock:
+            if auth_headers is None or auth_headers == self._cached_headers:
+                self._cached_headers = None
+                self._reload_api_key = True
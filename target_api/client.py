@@ -2,10 +2,10 @@ from __future__ import annotations
 
 import json
 import os
+import time
 from sys import getsizeof
 
 from pydantic import BaseModel
-from target_hotglue.auth import ApiAuthenticator
 from target_hotglue.client import HotglueBaseSink
 from target_hotglue.common import HGJSONEncoder
 import requests
@@ -13,24 +13,29 @@ import urllib3
 from singer_sdk.exceptions import FatalAPIError, RetriableAPIError
 import backoff
 
+from target_api.state import (
+    STATE_DETAIL_COMPACT,
+    STATE_DETAIL_FULL,
+    STATE_DETAIL_SUMMARY,
+    compact_bookmarks_tail,
+)
+
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class ApiSink(HotglueBaseSink):
+    # monotonic timestamp of the oldest record not yet drained
+    _pending_since = None
+    # moving average in seconds of the requests sent by this sink
+    request_latency = None
+
     @property
     def name(self):
         return self.stream_name
 
     @property
     def authenticator(self):
-        return (
-            ApiAuthenticator(
-                self._target,
-                header_name=self._config.get("api_key_header") or "x-api-key",
-            )
-            if self._config.get("auth", False) or self._config.get("api_key_url")
-            else None
-        )
+        return self._target.shared_authenticator
 
     @property
     def base_url(self) -> str:
@@ -92,6 +97,79 @@ class ApiSink(HotglueBaseSink):
 
         return is_full_in_length or is_full_in_bytes
 
+    @property
+    def max_batch_age(self):
+        return self._target.max_batch_age
+
+    @property
+    def pending_age(self) -> float:
+        if self._pending_since is None:
+            return 0.0
+        return time.monotonic() - self._pending_since
+
+    @property
+    def is_stale(self) -> bool:
+        """Check if the oldest pending record is older than `max_batch_age`."""
+        if not self.max_batch_age or self._pending_since is None:
+            return False
+        return self.pending_age >= self.max_batch_age
+
+    @property
+    def state_detail(self) -> str:
+        return self._config.get("state_detail") or STATE_DETAIL_FULL
+
+    @property
+    def state_max_bookmarks(self) -> int:
+        return int(self._config.get("state_max_bookmarks") or 100)
+
+    def update_state(self, *args, **kwargs) -> None:
+        super().update_state(*args, **kwargs)
+        if self.state_detail == STATE_DETAIL_FULL:
+            return
+
+        bookmarks = (self.latest_state or {}).get("bookmarks", {}).get(self.name)
+        if not bookmarks:
+            return
+        # summary counters are kept as is, only the per-item detail is reduced
+        if self.state_detail == STATE_DETAIL_SUMMARY:
+            compact_bookmarks_tail(bookmarks, 1)
+        elif self.state_detail == STATE_DETAIL_COMPACT:
+            compact_bookmarks_tail(bookmarks, self.state_max_bookmarks)
+
+    def observe_latency(self, latency: float) -> None:
+        if self.request_latency is None:
+            self.request_latency = latency
+        else:
+            self.request_latency = 0.7 * self.request_latency + 0.3 * latency
+
+    def _after_process_record(self, context: dict) -> None:
+        super()._after_process_record(context)
+        # only sinks that buffer records have something to flush, RecordSink sends
+        # right away and its current_size is always 0 so it is never marked drained
+        if self._pending_since is None and self.current_size:
+            self._pending_since = time.monotonic()
+
+    def init_state(self) -> None:
+        if not self._target.streaming_job:
+            return super().init_state()
+
+        # NOTE: streaming jobs keep the target's state under "target", next to the
+        # tap's, while the base init_state expects bookmarks at the top level
+        target_state = (self._target._latest_state or {}).get("target") or {}
+        bookmarks = (target_state.get("bookmarks") or {}).get(self.name)
+        summary = (target_state.get("summary") or {}).get(self.name)
+        self.latest_state = {
+            "bookmarks": {self.name: list(bookmarks or [])},
+            "summary": {
+                self.name: dict(summary or {"success": 0, "fail": 0, "existing": 0, "updated": 0})
+            },
+        }
+        self.summary_init = True
+
+    def mark_drained(self) -> None:
+        super().mark_drained()
+        self._pending_since = None
+
     def response_error_message(self, response: requests.Response) -> str:
         try:
             response_text = f" with response body: '{response.text}'"[:5000]
@@ -152,8 +230,6 @@ class ApiSink(HotglueBaseSink):
     ) -> requests.PreparedRequest:
         """Prepare a request object."""
         url = self.url(endpoint)
-        headers.update(self.default_headers)
-        headers.update({"Content-Type": "application/json"})
         params.update(self.params)
 
         # changing data dumping to be able to send {} for when post_empty_record is true
@@ -163,14 +239,40 @@ class ApiSink(HotglueBaseSink):
             else None
         )
 
-        response = requests.request(
-            method=http_method,
-            url=url,
-            params=params,
-            headers=headers,
-            data=data,
-            verify=verify,
-            timeout=self._config.get("timeout", 600)
-        )
+        authenticator = self.authenticator
+        for attempt in range(2):
+            auth_headers = authenticator.auth_headers if authenticator else None
+            headers.update(self.default_headers)
+            headers.update({"Content-Type": "application/json"})
+
+            request_started_at = time.monotonic()
+            response = requests.request(
+                method=http_method,
+                url=url,
+                params=params,
+                headers=headers,
+                data=data,
+                verify=verify,
+                timeout=self._config.get("timeout", 600)
+            )
+            latency = time.monotonic() - request_started_at
+            self.observe_latency(latency)
+
+            trace_recorder = self._target.trace_recorder
+            if trace_recorder:
+                trace_recorder.record(
+                    self.stream_name,
+                    response,
+                    latency,
+                    request_data=data,
+                    request_records=len(request_data) if isinstance(request_data, list) else 1,
+                )
+            if response.status_code != 401 or not authenticator or attempt:
+                break
+
+            # credentials may have expired or been rotated: refresh them and retry once
+            self.logger.warning("Received 401 Unauthorized, refreshing credentials and retrying.")
+            authenticator.invalidate(auth_headers)
+
         self.validate_response(response)
         return response
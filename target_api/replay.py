@@ -0,0 +1,175 @@
+"""Request recording and replay for target-api.
+
+Set `record_trace` in the config to a file path (gzipped if it ends with `.gz`)
+to record every request sent by the sinks. A recorded trace can then be served
+by a local stand-in for the customer's endpoint:
+
+    python -m target_api.replay trace.jsonl.gz --port 8080
+
+and the target pointed at it with `"url": "http://127.0.0.1:8080/{stream}"`.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+
+# recorded bodies are decoded, so these no longer describe them
+SKIPPED_RESPONSE_HEADERS = {"connection", "content-encoding", "content-length", "transfer-encoding"}
+# flushing a gzip stream ends a deflate block, doing it on every entry bloats the trace
+FLUSH_INTERVAL = 1.0
+
+
+def open_trace(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TraceRecorder:
+    """Append request/response pairs to a JSON lines trace file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open_trace(path, "w")
+        self._flushed_at = time.monotonic()
+
+    def record(
+        self,
+        stream: str,
+        response: requests.Response,
+        latency: float,
+        request_data: Optional[str] = None,
+        request_records: Optional[int] = None,
+    ) -> None:
+        request = response.request
+        entry = {
+            "stream": stream,
+            "request": {
+                "method": request.method,
+                "path": urlparse(request.url).path,
+                "size": len(request_data) if request_data else 0,
+                "records": request_records,
+            },
+            "response": {
+                "status": response.status_code,
+                "headers": dict(response.headers),
+                "body": response.text,
+            },
+            "latency": round(latency, 6),
+        }
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            # flush periodically so a trace of a killed job is readable up to the last flush
+            if time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed_at = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def load_trace(path: str) -> list:
+    """Load a trace, including one left unfinished by a job that was killed."""
+    lines = []
+    with open_trace(path, "r") as trace:
+        try:
+            for line in trace:
+                lines.append(line)
+        except EOFError:
+            # gzip stream without its end marker: keep what was flushed
+            pass
+
+    entries = []
+    for i, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # the last line may have been cut mid-write
+            if i != len(lines) - 1:
+                raise
+    return entries
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Serve recorded responses with their original latencies.
+
+    Requests are matched on method and path and get the recorded responses for
+    them in order, cycling once a path runs out of recorded responses.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, trace_path: str, host: str = "127.0.0.1", port: int = 0, latency_scale: float = 1.0) -> None:
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries = defaultdict(deque)
+        for entry in load_trace(trace_path):
+            request = entry["request"]
+            self._entries[(request["method"], request["path"])].append(entry)
+        super().__init__((host, port), _ReplayHandler)
+
+    def next_entry(self, method: str, path: str) -> Optional[dict]:
+        with self._lock:
+            entries = self._entries.get((method, path))
+            if not entries:
+                return None
+            entry = entries.popleft()
+            entries.append(entry)
+            return entry
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    def _replay(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        entry = self.server.next_entry(self.command, urlparse(self.path).path)
+        if entry is None:
+            self.send_error(404, "No recorded response for this request")
+            return
+
+        time.sleep(entry["latency"] * self.server.latency_scale)
+
+        response = entry["response"]
+        body = (response["body"] or "").encode("utf-8")
+        self.send_response(response["status"])
+        for name, value in response["headers"].items():
+            if name.lower() not in SKIPPED_RESPONSE_HEADERS:
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _replay
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a target-api request trace.")
+    parser.add_argument("trace", help="Trace file recorded with the record_trace setting")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier for recorded latencies")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.trace, args.host, args.port, args.latency_scale)
+    print(f"Replaying {args.trace} on http://{args.host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Drain scheduler for target-api."""
+from __future__ import annotations
+
+import threading
+from collections import Counter, deque
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlparse
+
+
+class DrainScheduler:
+    """Drain sinks on a pool of workers, giving slots to the sinks with most work left.
+
+    Batch sinks are split into one task per request so idle workers can pick up
+    sub-batches of the largest sink. The remaining work of a sink is estimated as
+    its pending requests times the latency observed on its endpoint, and each
+    endpoint host is limited to `host_limits` concurrent requests.
+    """
+
+    def __init__(
+        self,
+        target,
+        parallelism: int,
+        host_limits: Optional[Union[int, Dict[str, int]]] = None,
+    ) -> None:
+        self.target = target
+        self.parallelism = parallelism
+        self.host_limits = host_limits
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._unfinished = Counter()
+        self._hosts = {}
+        self._host_active = Counter()
+        self._error = None
+
+    def host_limit(self, host: str) -> int:
+        if isinstance(self.host_limits, dict):
+            limit = self.host_limits.get(host)
+        else:
+            limit = self.host_limits
+        return int(limit) if limit else self.parallelism
+
+    def _can_split(self, sink) -> bool:
+        # post_empty_record relies on the target's drain_one to send empty records
+        return (
+            hasattr(sink, "make_batch_request")
+            and not self.target.config.get("post_empty_record", False)
+        )
+
+    def _enqueue(self, sink) -> None:
+        if not self._can_split(sink):
+            tasks = deque([None])
+        else:
+            if sink.current_size == 0:
+                return
+            records = (sink.start_drain() or {}).get("records") or []
+            if not sink.latest_state:
+                sink.init_state()
+            tasks = deque(
+                records[i:i + sink.max_size] for i in range(0, len(records), sink.max_size)
+            )
+            if not tasks:
+                sink.mark_drained()
+                return
+
+        self._queues[sink] = tasks
+        self._unfinished[sink] = len(tasks)
+        self._hosts[sink] = urlparse(sink.base_url).netloc
+
+    def _remaining_cost(self, sink, default_latency: float) -> float:
+        tasks = self._queues[sink]
+        units = len(tasks) if tasks[0] is not None else max(sink.current_size, 1)
+        return units * (sink.request_latency or default_latency)
+
+    def _next_task(self):
+        latencies = [s.request_latency for s in self._queues if s.request_latency]
+        default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+
+        candidates = [
+            sink
+            for sink, tasks in self._queues.items()
+            if tasks and self._host_active[self._hosts[sink]] < self.host_limit(self._hosts[sink])
+        ]
+        if not candidates:
+            return None
+
+        sink = max(candidates, key=lambda s: self._remaining_cost(s, default_latency))
+        return sink, self._queues[sink].popleft()
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._error:
+                        return
+                    task = self._next_task()
+                    if task:
+                        break
+                    if not any(self._queues.values()):
+                        return
+                    self._cond.wait()
+                sink, records = task
+                host = self._hosts[sink]
+                self._host_active[host] += 1
+
+            try:
+                if records is None:
+                    self.target.drain_one(sink)
+                else:
+                    sink.process_batch({"records": records})
+            except Exception as e:
+                with self._cond:
+                    self._error = self._error or e
+            finally:
+                with self._cond:
+                    self._host_active[host] -= 1
+                    self._unfinished[sink] -= 1
+                    if records is not None and not self._unfinished[sink]:
+                        sink.mark_drained()
+                    self._cond.notify_all()
+
+    def run(self, sinks: List) -> None:
+        for sink in sinks:
+            if sink:
+                self._enqueue(sink)
+
+        n_tasks = sum(len(tasks) for tasks in self._queues.values())
+        workers = [
+            threading.Thread(target=self._work, name=f"target-api-drain-{i}", daemon=True)
+            for i in range(min(self.parallelism, n_tasks))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self._error:
+            raise self._error
@@ -9,6 +9,7 @@ from target_hotglue.client import HotglueBatchSink, HotglueSink
 from target_api.client import ApiSink
 import os
 import hashlib
+import threading
 
 
 class RecordSink(ApiSink, HotglueSink):
@@ -47,6 +48,11 @@ class BatchSink(ApiSink, HotglueBatchSink):
 
     send_empty_record = False
 
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # sub-batches of the same sink can be sent concurrently by the drain scheduler
+        self._state_lock = threading.Lock()
+
     @property
     def max_size(self):
         if self.config.get("process_as_batch"):
@@ -86,10 +92,11 @@ class BatchSink(ApiSink, HotglueBatchSink):
         return id
     
     def generate_batch_id(self):
-        index = self._target.batch_id_index
+        with self._target.batch_id_lock:
+            index = self._target.batch_id_index
+            self._target.batch_id_index += 1
         external_id = f"{os.environ.get('JOB_ROOT', 'job_Example')}:{self.name}:{index}"
         external_id = hashlib.md5(external_id.encode()).hexdigest()
-        self._target.batch_id_index += 1
         return external_id
 
     def process_batch(self, context: dict) -> None:
@@ -114,13 +121,15 @@ class BatchSink(ApiSink, HotglueBatchSink):
             try:
                 id = self.make_batch_request(records)
                 result = self.handle_batch_response(id, batch_external_id)
-                for state in result.get("state_updates", list()):
-                    self.update_state(state)
+                with self._state_lock:
+                    for state in result.get("state_updates", list()):
+                        self.update_state(state)
             except Exception as e:
                 state = {"error": str(e)}
                 if inject_batch_ids:
                     state.update({"hgBatchId": batch_external_id})
-                self.update_state(state)
+                with self._state_lock:
+                    self.update_state(state)
 
     def handle_batch_response(self, id, batch_external_id=None) -> dict:
         state = {"id": id, "success": True}
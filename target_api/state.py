@@ -0,0 +1,73 @@
+"""Compact state helpers for target-api."""
+from __future__ import annotations
+
+from functools import reduce
+from typing import List
+
+STATE_DETAIL_FULL = "full"
+STATE_DETAIL_COMPACT = "compact"
+STATE_DETAIL_SUMMARY = "summary"
+
+# keys added by compaction, everything else comes from the bookmarks themselves
+RUN_KEYS = ("count", "failed", "first_id", "first_hgBatchId")
+
+
+def is_bookmark_run(bookmark: dict) -> bool:
+    return "count" in bookmark
+
+
+def to_bookmark_run(bookmark: dict) -> dict:
+    if is_bookmark_run(bookmark):
+        return bookmark
+    success = bool(bookmark.get("success"))
+    run = dict(bookmark)
+    run.update({
+        "success": success,
+        "count": 1,
+        "failed": 0 if success else 1,
+        "first_id": bookmark.get("id"),
+    })
+    if "hgBatchId" in bookmark:
+        run["first_hgBatchId"] = bookmark["hgBatchId"]
+    return run
+
+
+def merge_bookmarks(older: dict, newer: dict) -> dict:
+    """Merge two bookmarks into a run.
+
+    The run keeps every field of the newest bookmark (`id`, `hgBatchId`, `error`, ...)
+    so readers of plain bookmarks keep working, and adds the number of bookmarks
+    and failures it covers along with the first `id`/`hgBatchId`.
+    """
+    older, newer = to_bookmark_run(older), to_bookmark_run(newer)
+    run = {key: value for key, value in newer.items() if key not in RUN_KEYS}
+    if "error" not in run and "error" in older:
+        run["error"] = older["error"]
+    run["count"] = older["count"] + newer["count"]
+    run["failed"] = older["failed"] + newer["failed"]
+    run["success"] = run["failed"] == 0
+    run["first_id"] = older["first_id"]
+    if "first_hgBatchId" in older:
+        run["first_hgBatchId"] = older["first_hgBatchId"]
+    return run
+
+
+def compact_bookmarks_tail(bookmarks: List[dict], max_bookmarks: int) -> None:
+    """Compact a bookmark list right after a bookmark was appended to it.
+
+    Consecutive successful bookmarks are collapsed into a single run. Failed
+    bookmarks are kept as is, and once the list holds more than `max_bookmarks`
+    entries the oldest ones are folded into an aggregate run, so the list never
+    grows past `max_bookmarks`.
+    """
+    max_bookmarks = max(int(max_bookmarks), 1)
+
+    if len(bookmarks) >= 2:
+        last, prev = bookmarks[-1], bookmarks[-2]
+        if last.get("success") and prev.get("success"):
+            bookmarks[-2:] = [merge_bookmarks(prev, last)]
+
+    excess = len(bookmarks) - max_bookmarks
+    if excess > 0:
+        # a single slice assignment, a resumed state can hold millions of bookmarks
+        bookmarks[:excess + 1] = [reduce(merge_bookmarks, bookmarks[:excess + 1])]
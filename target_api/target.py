@@ -2,17 +2,26 @@
 
 from __future__ import annotations
 
-from typing import Type, Optional
+from pathlib import PurePath
+from typing import TYPE_CHECKING, List, Type, Optional
 import copy
+import json
+import threading
 
 from singer_sdk import Sink
+from singer_sdk.exceptions import ConfigValidationError
 from target_hotglue.target import TargetHotglue
 
+from target_api.auth import CachedApiAuthenticator
+from target_api.scheduler import DrainScheduler
 from target_api.sinks import BatchSink, RecordSink
 from singer_sdk.helpers._compat import final
 from collections import OrderedDict
 from target_hotglue.target_base import update_state
 
+if TYPE_CHECKING:
+    from target_api.replay import TraceRecorder
+
 
 class TargetApi(TargetHotglue):
     """Sample target for Api."""
@@ -21,6 +30,7 @@ class TargetApi(TargetHotglue):
     SINK_TYPES = [RecordSink, BatchSink]
     target_counter = {}
     batch_id_index = 0
+    batch_id_lock = threading.Lock()
     last_processed_sink = None
 
     @property
@@ -30,7 +40,19 @@ class TargetApi(TargetHotglue):
         if self.config.get("enforce_order"):
             return 1
 
-        return 10
+        return int(self.config.get("max_parallelism") or 10)
+
+    @property
+    def max_batch_age(self) -> Optional[float]:
+        """Age in seconds after which a sink's pending records are flushed.
+
+        Configured through `linger_ms` (milliseconds) or `max_batch_age` (seconds).
+        """
+        if self.config.get("linger_ms"):
+            return float(self.config["linger_ms"]) / 1000
+        if self.config.get("max_batch_age"):
+            return float(self.config["max_batch_age"])
+        return None
 
     def __init__(
         self,
@@ -41,9 +63,76 @@ class TargetApi(TargetHotglue):
     ) -> None:
         super().__init__(config, parse_env_config, validate_config, state)
 
+        # NOTE: RecordSink finds duplicate records through the `hash` of every bookmark,
+        # compacting them would silently disable that check
+        state_detail = self.config.get("state_detail") or "full"
+        if state_detail != "full" and not self.config.get("process_as_batch"):
+            raise ConfigValidationError(
+                f"state_detail '{state_detail}' is only supported with process_as_batch"
+            )
+
+        # NOTE: keep the config files around so credentials rotated mid-job can be re-read
+        if isinstance(config, (str, PurePath)):
+            self._config_paths = [config]
+        elif isinstance(config, list):
+            self._config_paths = list(config)
+        else:
+            self._config_paths = []
+
         # NOTE: We want to override this with an ordered dict to enforce order when we iterate later
         self._sinks_active = OrderedDict()
 
+        # NOTE: the linger timer drains sinks from a background thread, so every
+        # path that touches sinks or writes state must hold this lock
+        self._drain_lock = threading.RLock()
+        self._linger_thread = None
+        self._linger_stop = threading.Event()
+        self._linger_error = None
+
+        self._auth_lock = threading.Lock()
+        self._shared_authenticator = None
+
+        self._trace_lock = threading.Lock()
+        self._trace_recorder = None
+
+    @property
+    def shared_authenticator(self) -> Optional[CachedApiAuthenticator]:
+        """Authenticator shared by all sinks, built on first use."""
+        if not (self.config.get("auth", False) or self.config.get("api_key_url")):
+            return None
+        with self._auth_lock:
+            if self._shared_authenticator is None:
+                self._shared_authenticator = CachedApiAuthenticator(
+                    self,
+                    header_name=self.config.get("api_key_header") or "x-api-key",
+                )
+        return self._shared_authenticator
+
+    def read_api_key(self) -> Optional[str]:
+        """Read the current api key, picking up keys rotated in the config files."""
+        api_key = self.config.get("api_key")
+        for path in self._config_paths:
+            try:
+                with open(path) as config_file:
+                    api_key = json.load(config_file).get("api_key", api_key)
+            except (OSError, ValueError):
+                self.logger.warning(f"Unable to re-read api key from {path}")
+        return api_key
+
+    @property
+    def trace_recorder(self) -> Optional[TraceRecorder]:
+        """Recorder for the requests sent by the sinks, enabled by `record_trace`."""
+        if not self.config.get("record_trace"):
+            return None
+
+        # NOTE: imported here to keep the target's cold start light
+        from target_api.replay import TraceRecorder
+
+        with self._trace_lock:
+            if self._trace_recorder is None:
+                self._trace_recorder = TraceRecorder(self.config["record_trace"])
+        return self._trace_recorder
+
     def get_sink_class(self, stream_name: str) -> Type[Sink]:
         if self.config.get("process_as_batch"):
             return BatchSink
@@ -107,21 +196,45 @@ class TargetApi(TargetHotglue):
                           is called after the target instance has finished
                           listening to the stdin
         """
-        state = copy.deepcopy(self._latest_state)
-        self._drain_all(self._sinks_to_clear, 1)
-        if is_endofpipe:
-            for sink in self._sinks_to_clear:
-                if sink:
-                    sink.clean_up()
-        self._sinks_to_clear = []
-        self._drain_all(list(self._sinks_active.values()), self.max_parallelism)
-        if is_endofpipe:
-            for sink in self._sinks_active.values():
-                if sink:
-                    sink.clean_up()
-
-        # Build state from BatchSinks
-        batch_sinks = [s for s in self._sinks_active.values() if isinstance(s, BatchSink)]
+        with self._drain_lock:
+            state = copy.deepcopy(self._latest_state)
+            self._drain_all(self._sinks_to_clear, 1)
+            if is_endofpipe:
+                for sink in self._sinks_to_clear:
+                    if sink:
+                        sink.clean_up()
+            self._sinks_to_clear = []
+            self._drain_all(list(self._sinks_active.values()), self.max_parallelism)
+            if is_endofpipe:
+                for sink in self._sinks_active.values():
+                    if sink:
+                        sink.clean_up()
+
+            state = self._merge_batch_sinks_state(state, list(self._sinks_active.values()))
+
+            # for single record sinks drain_all is executed after processing the records therefore the latest_state is already populated
+            # when there is no records drain_all is executed first so we process and write the state in drain_one and avoid writing an extra state here
+            if self.config.get("post_empty_record", False) and not self.config.get("process_as_batch"):
+                pass
+            else:
+                self._write_state_message(state)
+                self._reset_max_record_age()
+
+    def _drain_all(self, sink_list: List[Sink], parallelism: int) -> None:
+        if parallelism == 1:
+            for sink in sink_list:
+                self.drain_one(sink)
+            return
+
+        DrainScheduler(
+            self,
+            parallelism,
+            host_limits=self.config.get("max_parallelism_per_host"),
+        ).run(sink_list)
+
+    def _merge_batch_sinks_state(self, state: dict, sinks: List[Sink]) -> dict:
+        """Build state from BatchSinks."""
+        batch_sinks = [s for s in sinks if isinstance(s, BatchSink)]
         for s in batch_sinks:
             if self.streaming_job:
                 if s.name not in state["target"].get("bookmarks", []):
@@ -135,14 +248,82 @@ class TargetApi(TargetHotglue):
                 else:
                     state["bookmarks"][s.name] = s.latest_state["bookmarks"][s.name]
                     state["summary"][s.name] = s.latest_state["summary"][s.name]
+        return state
 
-        # for single record sinks drain_all is executed after processing the records therefore the latest_state is already populated
-        # when there is no records drain_all is executed first so we process and write the state in drain_one and avoid writing an extra state here
-        if self.config.get("post_empty_record", False) and not self.config.get("process_as_batch"):
-            pass
-        else:
+    def drain_stale(self) -> None:
+        """Drain the sinks whose oldest pending record exceeded `max_batch_age` and emit STATE."""
+        with self._drain_lock:
+            stale_sinks = [s for s in self._sinks_active.values() if s.is_stale]
+            if not stale_sinks:
+                return
+
+            state = copy.deepcopy(self._latest_state)
+            for sink in stale_sinks:
+                self.logger.info(
+                    f"Target sink for '{sink.stream_name}' exceeded max batch age. Draining..."
+                )
+                # skip our drain_one override: a linger flush must never post empty records
+                super().drain_one(sink)
+
+            state = self._merge_batch_sinks_state(state, stale_sinks)
             self._write_state_message(state)
-            self._reset_max_record_age()
+
+    def _linger_loop(self, interval: float) -> None:
+        while not self._linger_stop.wait(interval):
+            try:
+                self.drain_stale()
+            except Exception as e:
+                # surface the error on the main thread with the next message
+                self._linger_error = e
+                return
+
+    def _start_linger_timer(self) -> None:
+        if self._linger_thread or not self.streaming_job or not self.max_batch_age:
+            return
+        interval = min(max(self.max_batch_age / 4, 0.05), 1.0)
+        self._linger_thread = threading.Thread(
+            target=self._linger_loop, args=(interval,), name="target-api-linger", daemon=True
+        )
+        self._linger_thread.start()
+
+    def _stop_linger_timer(self) -> None:
+        if not self._linger_thread:
+            return
+        self._linger_stop.set()
+        self._linger_thread.join()
+        self._linger_thread = None
+
+    def _raise_linger_error(self) -> None:
+        if self._linger_error:
+            error, self._linger_error = self._linger_error, None
+            raise error
+
+    def _process_endofpipe(self) -> None:
+        self._stop_linger_timer()
+        self._raise_linger_error()
+        try:
+            super()._process_endofpipe()
+        finally:
+            if self._trace_recorder:
+                self._trace_recorder.close()
+
+    # NOTE: every message handler that adds, drains or removes sinks takes the drain lock
+    # so the linger timer never sees `_sinks_active` change under it
+    def _process_schema_message(self, message_dict: dict) -> None:
+        with self._drain_lock:
+            super()._process_schema_message(message_dict)
+
+    def _process_state_message(self, message_dict: dict) -> None:
+        with self._drain_lock:
+            super()._process_state_message(message_dict)
+
+    def _process_activate_version_message(self, message_dict: dict) -> None:
+        with self._drain_lock:
+            super()._process_activate_version_message(message_dict)
+
+    def _process_batch_message(self, message_dict: dict) -> None:
+        with self._drain_lock:
+            super()._process_batch_message(message_dict)
 
     def _process_record_message(self, message_dict: dict) -> None:
         """Process a RECORD message.
@@ -150,68 +331,72 @@ class TargetApi(TargetHotglue):
         Args:
             message_dict: TODO
         """
-        self._assert_line_requires(message_dict, requires={"stream", "record"})
-
-        stream_name = message_dict["stream"]
-        for stream_map in self.mapper.stream_maps[stream_name]:
-            # new_schema = helpers._float_to_decimal(new_schema)
-            raw_record = copy.copy(message_dict["record"])
-            transformed_record = stream_map.transform(raw_record)
-            if transformed_record is None:
-                # Record was filtered out by the map transform
-                continue
-
-            sink = self.get_sink(stream_map.stream_alias, record=transformed_record)
-
-            if not self.last_processed_sink:
-                self.last_processed_sink = sink
-            elif self.last_processed_sink != sink:
-                # when processing a new sink, we need to drain the last processed sink to keep the order of the records
-                self.drain_one(self.last_processed_sink)
-                self.last_processed_sink = sink
-
-            context = sink._get_context(transformed_record)
-            if sink.include_sdc_metadata_properties:
-                sink._add_sdc_metadata_to_record(
-                    transformed_record, message_dict, context
-                )
-            else:
-                sink._remove_sdc_metadata_from_record(transformed_record)
+        self._raise_linger_error()
+        self._start_linger_timer()
+
+        with self._drain_lock:
+            self._assert_line_requires(message_dict, requires={"stream", "record"})
+
+            stream_name = message_dict["stream"]
+            for stream_map in self.mapper.stream_maps[stream_name]:
+                # new_schema = helpers._float_to_decimal(new_schema)
+                raw_record = copy.copy(message_dict["record"])
+                transformed_record = stream_map.transform(raw_record)
+                if transformed_record is None:
+                    # Record was filtered out by the map transform
+                    continue
+
+                sink = self.get_sink(stream_map.stream_alias, record=transformed_record)
+
+                if not self.last_processed_sink:
+                    self.last_processed_sink = sink
+                elif self.last_processed_sink != sink:
+                    # when processing a new sink, we need to drain the last processed sink to keep the order of the records
+                    self.drain_one(self.last_processed_sink)
+                    self.last_processed_sink = sink
+
+                context = sink._get_context(transformed_record)
+                if sink.include_sdc_metadata_properties:
+                    sink._add_sdc_metadata_to_record(
+                        transformed_record, message_dict, context
+                    )
+                else:
+                    sink._remove_sdc_metadata_from_record(transformed_record)
 
-            sink._validate_and_parse(transformed_record)
+                sink._validate_and_parse(transformed_record)
 
-            sink.tally_record_read()
-            transformed_record = sink.preprocess_record(transformed_record, context)
-            sink.process_record(transformed_record, context)
-            sink._after_process_record(context)
+                sink.tally_record_read()
+                transformed_record = sink.preprocess_record(transformed_record, context)
+                sink.process_record(transformed_record, context)
+                sink._after_process_record(context)
 
-            if sink.is_full:
-                self.logger.info(
-                    f"Target sink for '{sink.stream_name}' is full. Draining..."
-                )
-                self.drain_one(sink)
+                if sink.is_full:
+                    self.logger.info(
+                        f"Target sink for '{sink.stream_name}' is full. Draining..."
+                    )
+                    self.drain_one(sink)
 
-            sink_latest_state = sink.latest_state or dict()
-            if self.streaming_job:
-                if not self._latest_state["target"]:
-                    # If "self._latest_state["target"]" is empty, save the value of "sink.latest_state"
-                    self._latest_state["target"] = sink_latest_state
-                else:
-                    # If "self._latest_state["target"]" is not empty, update all its fields with the
-                    # fields from "sink.latest_state" (if they exist)
-                    for key in self._latest_state["target"].keys():
-                        if isinstance(self._latest_state["target"][key], dict):
-                            self._latest_state["target"][key].update(sink_latest_state.get(key) or dict())
-            else:
-                if not self._latest_state:
-                    # If "self._latest_state" is empty, save the value of "sink.latest_state"
-                    self._latest_state = sink_latest_state
+                sink_latest_state = sink.latest_state or dict()
+                if self.streaming_job:
+                    if not self._latest_state["target"]:
+                        # If "self._latest_state["target"]" is empty, save the value of "sink.latest_state"
+                        self._latest_state["target"] = sink_latest_state
+                    else:
+                        # If "self._latest_state["target"]" is not empty, update all its fields with the
+                        # fields from "sink.latest_state" (if they exist)
+                        for key in self._latest_state["target"].keys():
+                            if isinstance(self._latest_state["target"][key], dict):
+                                self._latest_state["target"][key].update(sink_latest_state.get(key) or dict())
                 else:
-                    # If "self._latest_state" is not empty, update all its fields with the
-                    # fields from "sink.latest_state" (if they exist)
-                    for key in self._latest_state.keys():
-                        if isinstance(self._latest_state[key], dict):
-                            self._latest_state[key].update(sink_latest_state.get(key) or dict())
+                    if not self._latest_state:
+                        # If "self._latest_state" is empty, save the value of "sink.latest_state"
+                        self._latest_state = sink_latest_state
+                    else:
+                        # If "self._latest_state" is not empty, update all its fields with the
+                        # fields from "sink.latest_state" (if they exist)
+                        for key in self._latest_state.keys():
+                            if isinstance(self._latest_state[key], dict):
+                                self._latest_state[key].update(sink_latest_state.get(key) or dict())
 
 if __name__ == "__main__":
     TargetApi.cli()
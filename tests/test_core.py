@@ -4,15 +4,23 @@ from __future__ import annotations
 
 import io
 import json
+import threading
+import time
 import pytest
 from singer_sdk.testing import target_sync_test
 
 import backoff._sync as backoff_sync
 import requests
+from singer_sdk.exceptions import ConfigValidationError, FatalAPIError
 
 from target_api.client import ApiSink
 from target_api.sinks import BatchSink, RecordSink
+from target_api import replay
+from target_api.replay import ReplayServer, TraceRecorder, load_trace
+from target_api.scheduler import DrainScheduler
+from target_api.state import compact_bookmarks_tail
 from target_api.target import TargetApi
+from target_hotglue.target import TargetHotglue
 
 
 def _singer_input(
@@ -268,3 +276,308 @@ def test_enforce_order_parallelism() -> None:
     assert target.MAX_PARALLELISM == 1
     target = TargetApi(config={"url": "https://example.com/{stream}", "enforce_order": False})
     assert target.MAX_PARALLELISM == 10
+
+
+def test_sink_is_stale_after_max_batch_age() -> None:
+    target = TargetApi(
+        config={"url": "https://example.com/{stream}", "process_as_batch": True, "linger_ms": 500}
+    )
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    record_sink = RecordSink(target, "users", schema, ["id"])
+    batch_sink = BatchSink(target, "orders", schema, ["id"])
+
+    assert target.max_batch_age == 0.5
+
+    # RecordSink sends right away, there is nothing pending to age
+    record_sink._after_process_record({})
+    assert record_sink.is_stale is False
+
+    batch_sink._pending_batch = {"records": [{"id": 1}]}
+    batch_sink._batch_records_read = 1
+    batch_sink._after_process_record({})
+    assert batch_sink.is_stale is False
+
+    batch_sink._pending_since = time.monotonic() - 1
+    assert batch_sink.is_stale is True
+
+    batch_sink.mark_drained()
+    assert batch_sink.is_stale is False
+
+
+def test_drain_stale_only_drains_aged_sinks(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent: list[str] = []
+    written: list[dict] = []
+    monkeypatch.setattr(BatchSink, "make_batch_request", lambda self, records: sent.append(self.stream_name))
+    monkeypatch.setattr(TargetApi, "_write_state_message", lambda self, state: written.append(state))
+
+    target = TargetApi(
+        config={"url": "https://example.com/{stream}", "process_as_batch": True, "max_batch_age": 1}
+    )
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    fresh = BatchSink(target, "fresh", schema, ["id"])
+    stale = BatchSink(target, "stale", schema, ["id"])
+    for sink in (fresh, stale):
+        sink._pending_batch = {"records": [{"id": 1}]}
+        sink._batch_records_read = 1
+        target._sinks_active[sink.stream_name] = sink
+
+    fresh._pending_since = time.monotonic()
+    stale._pending_since = time.monotonic() - 5
+    target.drain_stale()
+
+    assert sent == ["stale"]
+    assert len(written) == 1
+    assert stale.is_stale is False
+
+    # nothing left to flush: no more drains nor STATE messages
+    target.drain_stale()
+    assert sent == ["stale"]
+    assert len(written) == 1
+
+
+def test_streaming_job_flushes_aged_batch_before_end_of_pipe(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("STREAMING_JOB", "True")
+    events: list[str] = []
+
+    def _fake_make_batch_request(self, records):
+        events.append("batch")
+        return None
+
+    monkeypatch.setattr(BatchSink, "make_batch_request", _fake_make_batch_request, raising=True)
+    monkeypatch.setattr(TargetApi, "_write_state_message", lambda self, state: events.append("state"))
+
+    class _TricklingInput:
+        """Send the records, then keep the pipe open until a flush happened."""
+
+        def __init__(self, lines):
+            self.lines = lines
+
+        def __iter__(self):
+            yield from self.lines
+            deadline = time.monotonic() + 5
+            while "state" not in events and time.monotonic() < deadline:
+                time.sleep(0.01)
+            events.append("endofpipe")
+
+    target = TargetApi(
+        config={
+            "url": "https://example.com/{stream}",
+            "process_as_batch": True,
+            "batch_size": 100,
+            "linger_ms": 50,
+        }
+    )
+    lines = _singer_input([{"id": 1, "name": "Ada"}, {"id": 2, "name": "Lin"}]).getvalue().splitlines()
+    target.listen(_TricklingInput(lines))
+
+    assert events.index("batch") < events.index("state") < events.index("endofpipe")
+
+
+def test_authenticator_shared_across_sinks() -> None:
+    target = TargetApi(config={"url": "https://example.com/{stream}", "auth": True, "api_key": "secret"})
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    users = RecordSink(target, "users", schema, ["id"])
+    orders = RecordSink(target, "orders", schema, ["id"])
+
+    assert users.authenticator is orders.authenticator
+    assert users.authenticator.auth_headers == {"x-api-key": "secret"}
+
+
+def test_first_auth_headers_use_loaded_config(tmp_path) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"url": "https://example.com/{stream}", "auth": True, "api_key": "file"}))
+
+    target = TargetApi(config=str(config_path))
+    # e.g. a key provided through --config ENV on top of the file
+    target._config["api_key"] = "env"
+
+    assert target.shared_authenticator.auth_headers["x-api-key"] == "env"
+
+
+def test_request_retries_once_on_unauthorized(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"url": "https://example.com/{stream}", "auth": True, "api_key": "old"}))
+    sent_keys: list[str] = []
+    statuses = [401, 200]
+
+    def _fake_request(*, method, url, params=None, headers=None, data=None, verify=True, timeout=None):
+        sent_keys.append(headers["x-api-key"])
+        # the key is rotated while the job runs
+        config_path.write_text(json.dumps({"url": "https://example.com/{stream}", "auth": True, "api_key": "new"}))
+        return _make_response(statuses.pop(0))
+
+    monkeypatch.setattr(requests, "request", _fake_request, raising=True)
+
+    target = TargetApi(config=str(config_path))
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    sink = RecordSink(target, "users", schema, ["id"])
+
+    response = sink._request("POST", "", request_data={"id": 1}, headers={}, params={}, verify=True)
+
+    assert sent_keys == ["old", "new"]
+    assert response.status_code == 200
+
+    statuses.extend([401, 401])
+    with pytest.raises(FatalAPIError):
+        sink._request("POST", "", request_data={"id": 1}, headers={}, params={}, verify=True)
+    assert len(sent_keys) == 4
+
+
+def test_drain_scheduler_prioritizes_largest_sink(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent: list[tuple[str, int]] = []
+
+    def _fake_make_batch_request(self, records):
+        sent.append((self.stream_name, len(records)))
+        return None
+
+    monkeypatch.setattr(BatchSink, "make_batch_request", _fake_make_batch_request, raising=True)
+
+    target = TargetApi(
+        config={"url": "https://example.com/{stream}", "process_as_batch": True, "batch_size": 2}
+    )
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    small = BatchSink(target, "small", schema, ["id"])
+    large = BatchSink(target, "large", schema, ["id"])
+    for sink, n_records in [(small, 2), (large, 8)]:
+        sink._pending_batch = {"records": [{"id": i} for i in range(n_records)]}
+        sink._batch_records_read = n_records
+
+    DrainScheduler(target, parallelism=4, host_limits={"example.com": 1}).run([small, None, large])
+
+    assert sent[:2] == [("large", 2), ("large", 2)]
+    assert sorted(sent) == [("large", 2)] * 4 + [("small", 2)]
+    assert large.current_size == 0
+    assert small.current_size == 0
+
+
+def test_max_parallelism_from_config() -> None:
+    target = TargetApi(config={"url": "https://example.com/{stream}", "max_parallelism": 4})
+    assert target.MAX_PARALLELISM == 4
+
+
+def test_compact_bookmarks_tail_collapses_runs() -> None:
+    bookmarks: list[dict] = []
+    entries = [
+        {"id": 1, "success": True, "hgBatchId": "b1"},
+        {"id": 2, "success": True, "hgBatchId": "b2"},
+        {"id": 3, "success": True, "hgBatchId": "b3"},
+        {"id": 4, "success": False, "error": "boom"},
+        {"id": 5, "success": False, "error": "bang"},
+        {"id": 6, "success": False, "error": "last"},
+    ]
+    for entry in entries:
+        bookmarks.append(entry)
+        compact_bookmarks_tail(bookmarks, max_bookmarks=3)
+
+    assert bookmarks == [
+        {
+            "id": 4,
+            "success": False,
+            "error": "boom",
+            "count": 4,
+            "failed": 1,
+            "first_id": 1,
+            "first_hgBatchId": "b1",
+        },
+        {"id": 5, "success": False, "error": "bang"},
+        {"id": 6, "success": False, "error": "last"},
+    ]
+
+
+def test_compact_bookmarks_tail_caps_alternating_outcomes() -> None:
+    bookmarks: list[dict] = []
+    for i in range(1000):
+        bookmarks.append({"id": i, "success": i % 2 == 0})
+        compact_bookmarks_tail(bookmarks, max_bookmarks=100)
+
+    assert len(bookmarks) == 100
+    assert sum(b.get("count", 1) for b in bookmarks) == 1000
+    assert sum(b.get("failed", 0 if b["success"] else 1) for b in bookmarks) == 500
+    assert bookmarks[-1] == {"id": 999, "success": False}
+
+
+def test_compact_bookmarks_tail_folds_resumed_state_at_once() -> None:
+    bookmarks = [{"id": i, "success": i % 2 == 0} for i in range(50000)]
+
+    compact_bookmarks_tail(bookmarks, max_bookmarks=100)
+
+    assert len(bookmarks) == 100
+    assert bookmarks[0]["count"] == 49901
+    assert sum(b.get("count", 1) for b in bookmarks) == 50000
+
+
+def test_compact_state_keeps_summary_counters() -> None:
+    target = TargetApi(
+        config={"url": "https://example.com/{stream}", "process_as_batch": True, "state_detail": "compact"}
+    )
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    sink = BatchSink(target, "users", schema, ["id"])
+    sink.init_state()
+
+    for i in range(50):
+        sink.update_state({"id": i, "success": True, "hgBatchId": f"b{i}"})
+
+    assert sink.latest_state["bookmarks"]["users"] == [
+        {
+            "id": 49,
+            "success": True,
+            "hgBatchId": "b49",
+            "count": 50,
+            "failed": 0,
+            "first_id": 0,
+            "first_hgBatchId": "b0",
+        }
+    ]
+    assert sink.latest_state["summary"]["users"]["success"] == 50
+
+
+def test_compact_state_rejected_for_record_sinks() -> None:
+    with pytest.raises(ConfigValidationError):
+        TargetApi(config={"url": "https://example.com/{stream}", "state_detail": "compact"})
+
+
+def test_record_and_replay_trace(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    def _fake_request(*, method, url, params=None, headers=None, data=None, verify=True, timeout=None):
+        response = _make_response(201)
+        response._content = b'{"id": "rec-1"}'
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+    monkeypatch.setattr(requests, "request", _fake_request, raising=True)
+
+    trace_path = str(tmp_path / "trace.jsonl.gz")
+    target = TargetApi(config={"url": "https://example.com/{stream}", "record_trace": trace_path})
+    schema = {"type": "object", "properties": {"id": {"type": "integer"}}}
+    sink = RecordSink(target, "users", schema, ["id"])
+
+    sink._request("POST", "", request_data=[{"id": 1}, {"id": 2}], headers={}, params={}, verify=True)
+    target.trace_recorder.close()
+    monkeypatch.undo()
+
+    server = ReplayServer(trace_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = requests.post(f"http://127.0.0.1:{server.server_port}/users", json=[{"id": 1}])
+    finally:
+        server.shutdown()
+
+    assert response.status_code == 201
+    assert response.json() == {"id": "rec-1"}
+    assert response.headers["Content-Type"] == "application/json"
+
+
+def test_load_trace_of_unclosed_gzip(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.setattr(replay, "FLUSH_INTERVAL", 0)
+    response = _make_response(200)
+
+    trace_path = str(tmp_path / "trace.jsonl.gz")
+    recorder = TraceRecorder(trace_path)
+    for _ in range(10):
+        recorder.record("users", response, 0.1)
+
+    # the job is killed before the recorder is closed
+    entries = load_trace(trace_path)
+
+    assert len(entries) == 10
+    assert entries[0]["response"]["status"] == 200
+    recorder.close()
@@ -0,0 +1,129 @@
+"""Startup benchmarks for target-api.
+
+Each run spawns a fresh interpreter, so what is measured is the cold start of a
+short `target-api` job. These are wall-clock benchmarks: they only run when
+`TARGET_API_STARTUP_BENCH=1` is set and stay out of the unit test run. The
+budgets sit close to the measured baseline (about 0.6-0.9s to import the target,
+almost all of it in singer_sdk and target_hotglue) and can be adjusted with the
+`TARGET_API_IMPORT_BUDGET_MS`, `TARGET_API_OWN_IMPORT_BUDGET_MS` and
+`TARGET_API_FIRST_REQUEST_BUDGET_MS` env vars.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    os.environ.get("TARGET_API_STARTUP_BENCH") != "1",
+    reason="startup benchmarks only run with TARGET_API_STARTUP_BENCH=1",
+)
+
+IMPORT_BUDGET_MS = float(os.environ.get("TARGET_API_IMPORT_BUDGET_MS", 1200))
+OWN_IMPORT_BUDGET_MS = float(os.environ.get("TARGET_API_OWN_IMPORT_BUDGET_MS", 50))
+FIRST_REQUEST_BUDGET_MS = float(os.environ.get("TARGET_API_FIRST_REQUEST_BUDGET_MS", 2000))
+
+# the dependencies that make up nearly all of the import time
+HEAVY_MODULES = [
+    "singer_sdk",
+    "target_hotglue.target",
+    "target_hotglue.client",
+    "target_hotglue.target_base",
+    "pydantic",
+    "backoff",
+    "requests",
+]
+
+
+def _import_times_ms(code: str) -> dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def test_import_time_within_budget() -> None:
+    times = _import_times_ms("import target_api.target")
+
+    assert times["target_api.target"] < IMPORT_BUDGET_MS
+
+
+def test_own_import_time_within_budget() -> None:
+    # with the heavy dependencies already loaded, what is left is target-api's own cost
+    code = "; ".join(f"import {module}" for module in HEAVY_MODULES) + "; import target_api.target"
+    times = _import_times_ms(code)
+
+    for module in HEAVY_MODULES:
+        assert module in times
+    assert times["target_api.target"] < OWN_IMPORT_BUDGET_MS
+
+
+def test_time_to_first_request_within_budget(tmp_path: Path) -> None:
+    first_request_at = []
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not first_request_at:
+                first_request_at.append(time.monotonic())
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = b'{"id": "1"}'
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"url": f"http://127.0.0.1:{server.server_port}/{{stream}}"}))
+    messages = [
+        {
+            "type": "SCHEMA",
+            "stream": "users",
+            "schema": {"type": "object", "properties": {"id": {"type": "integer"}}},
+            "key_properties": ["id"],
+        },
+        {"type": "RECORD", "stream": "users", "record": {"id": 1}},
+    ]
+
+    try:
+        started_at = time.monotonic()
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "from target_api.target import TargetApi; TargetApi.cli()",
+                "--config",
+                str(config_path),
+            ],
+            input="\n".join(json.dumps(m) for m in messages) + "\n",
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    finally:
+        server.shutdown()
+
+    assert first_request_at, "the target should send the record"
+    assert (first_request_at[0] - started_at) * 1000 < FIRST_REQUEST_BUDGET_MS